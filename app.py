@@ -1,16 +1,58 @@
 import streamlit as st
-import pdfplumber
 import re
-from datetime import date, timedelta, datetime
-import math
+import io
+from datetime import date, timedelta
+from functools import lru_cache
+import numpy as np
 
-import calendar # 記得在檔案最上方 import calendar
+try:
+    from numba import njit
+    _HAVE_NUMBA = True
+except ImportError: # numba 為選用套件，未安裝時核心函式以純 Python 執行
+    _HAVE_NUMBA = False
+    def njit(*args, **kwargs):
+        return lambda func: func
 
+# --- 預先編譯 PDF 解析用的正規表達式 (只在載入時編譯一次) ---
+# 金額："應繳總金額 / 合計 / 小計 / 總計" 後面的數字，可帶 NT$ / NTD / $ 幣別 (不分大小寫)
+# 不加 re.ASCII：\s 需要能比對中文排版常見的全形空白
+_AMT_RE = re.compile(r'(應繳總金額|合計|小計|總計)[：:\s]*(?:NT\$?|NTD|\$)?\s*([\d,]+)', re.IGNORECASE)
+
+# 保費年月：三種格式合併成一條 regex，只需掃描全文一次
+# 各具名群組依優先順序排列，越上面的規則越精準
+# 整段包在零寬度的 lookahead 裡，每個位置都會嘗試比對且不吃掉文字，
+# 避免低優先的比對 (例如 "保險費年月：112年10月") 蓋掉與其重疊的高優先比對 ("112年10月 保費")
+_PERIOD_RE = re.compile(
+    r'(?='
+    # 優先級 1 (最高)：使用者指定的格式 "112年10月未繳保費" 或 "112年10月 保費"
+    # 說明：抓取數字+年+數字+月，且後面緊接著 "未繳" 或 "保費"
+    r'(?P<unpaid>(\d{2,3})\s*[年/]\s*(\d{1,2})\s*[月]?\s*(?:未繳|保費))'
+    # 優先級 2：標準欄位 "保險費年月：112年10月" 或 "保險費年月 112/10"
+    r'|(?P<field>保險費年月\s*[:：]?\s*(\d{2,3})\s*[年/]\s*(\d{1,2}))'
+    # 優先級 3：計費期間 "計費期間：112年10月"
+    r'|(?P<period>計費期間\s*[:：]?\s*(\d{2,3})\s*[年/]\s*(\d{1,2}))'
+    r')'
+)
+
+# 具名群組 -> (優先順序, 偵測依據說明)；年、月分別是具名群組後的第 1、2 個子群組
+_PERIOD_SOURCES = {
+    "unpaid": (0, "關鍵字：未繳/保費"),
+    "field": (1, "關鍵字：保險費年月"),
+    "period": (2, "關鍵字：計費期間"),
+}
+
+# 平年各月天數 (2 月遇閏年另外處理)
+_MDAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+@lru_cache(maxsize=None)
 def get_last_day_of_month(year, month):
     """取得該年份月份的最後一天 (自動處理閏年 2/29)"""
-    last_day = calendar.monthrange(year, month)[1]
+    last_day = _MDAYS[month - 1]
+    if month == 2 and (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)):
+        last_day = 29
     return date(year, month, last_day)
 
+@lru_cache(maxsize=None)
 def calculate_deadline_from_period(roc_year, month):
     """
     根據國民年金規則推算繳費期限：
@@ -57,115 +99,282 @@ INTEREST_RATES = {
     2023: 1.475, 2024: 1.600, 2025: 1.725, 2026: 1.725  # 2026 暫定沿用
 }
 
+# 最近一年的利率 (查無年度資料時沿用)，載入時計算一次即可
+_LATEST_YEAR = max(INTEREST_RATES)
+_LATEST_RATE = INTEREST_RATES[_LATEST_YEAR]
+
+# 本金上限 (元)：國民年金繳費單金額遠低於此；
+# 整數利息運算在 int64 下進行 (含 numba 核心)，限制本金以免 本金 × 利率 × 天數 溢位
+MAX_PRINCIPAL = 10_000_000
+
+# 利率 × 1000 的整數版 (例如 1.475% -> 1475)，計算利息時全程使用整數避免浮點誤差
+_RATES_X1000 = {year: round(rate * 1000) for year, rate in INTEREST_RATES.items()}
+_LATEST_RATE_X1000 = _RATES_X1000[_LATEST_YEAR]
+
 def get_rate(year):
     """取得該年度的利率，若無資料則回傳最近一年的資料"""
-    return INTEREST_RATES.get(year, INTEREST_RATES[max(INTEREST_RATES.keys())])
-
-def parse_pdf(file):
-    text = ""
-    with pdfplumber.open(file) as pdf:
-        for page in pdf.pages:
-            text += page.extract_text() + "\n"
-    
-    # 預設值
-    amount = 0
-    deadline = date.today()
-    extracted_period = None 
-    match_source = "無" # 用於除錯，告訴你是哪個規則抓到的
+    return INTEREST_RATES.get(year, _LATEST_RATE)
 
-    # --- 1. 抓取金額 (維持不變) ---
-    amt_match = re.search(r'(應繳總金額|合計|小計|總計)\s*[:：]?\s*[NTD$]*\s*([0-9,]+)', text)
+def find_amount(text):
+    """抓取繳費單金額，找不到則回傳 0"""
+    amt_match = _AMT_RE.search(text)
     if amt_match:
         try:
             amount_str = amt_match.group(2).replace(',', '')
-            amount = int(amount_str)
+            return int(amount_str)
         except:
             pass
+    return 0
 
-    # --- 2. 精準抓取保費年月 (新邏輯) ---
-    # 我們定義一個優先順序清單，越上面的規則越精準
-    
-    period_patterns = [
-        # 優先級 1 (最高)：使用者指定的格式 "112年10月未繳保費" 或 "112年10月 保費"
-        # 說明：抓取數字+年+數字+月，且後面緊接著 "未繳" 或 "保費"
-        (r'(\d{2,3})\s*[年/]\s*(\d{1,2})\s*[月]?\s*(?:未繳|保費)', "關鍵字：未繳/保費"),
+def find_period(text):
+    """
+    精準抓取保費年月，回傳 (優先順序, 繳費期限, 保費年月, 偵測依據)；找不到則回傳 None
+    優先順序數字越小越精準 (0 為最高)，供跨頁比較使用
+    一次掃描全文，保留優先順序最高且通過檢核的結果
+    """
+    result = None
+    best_priority = len(_PERIOD_SOURCES)
+    for match in _PERIOD_RE.finditer(text):
+        priority, source_name = _PERIOD_SOURCES[match.lastgroup]
+        if priority >= best_priority:
+            continue
+        try:
+            roc_y = int(match.group(match.lastindex + 1))
+            m = int(match.group(match.lastindex + 2))
 
-        # 優先級 2：標準欄位 "保險費年月：112年10月" 或 "保險費年月 112/10"
-        (r'保險費年月\s*[:：]?\s*(\d{2,3})\s*[年/]\s*(\d{1,2})', "關鍵字：保險費年月"),
-        
-        # 優先級 3：計費期間 "計費期間：112年10月"
-        (r'計費期間\s*[:：]?\s*(\d{2,3})\s*[年/]\s*(\d{1,2})', "關鍵字：計費期間")
-    ]
+            # 簡單檢核：月份必須在 1-12 之間，年份不太可能小於 97 (國民年金開辦年)
+            if 1 <= m <= 12 and roc_y > 90:
+                deadline = calculate_deadline_from_period(roc_y, m)
+                result = (priority, deadline, f"{roc_y}年{m}月", source_name)
+                best_priority = priority
+                if priority == 0:
+                    break # 已是最高優先順序，不必再往後找
+        except:
+            continue
+    return result
 
-    for pattern, source_name in period_patterns:
-        match = re.search(pattern, text)
-        if match:
+def page_text_from_chars(page, x_tolerance=3, y_tolerance=3):
+    """
+    直接依 page.chars 的原始順序串出文字，略過 extract_text() 的版面重建 (分行分群、排序)。
+    我們只需要對關鍵字做 regex，不需要精確排版；
+    只在換行處補上換行、字距過大處補上空白，避免相鄰欄位的數字黏在一起。
+    """
+    out = []
+    prev = None
+    for c in page.chars:
+        if prev is not None:
+            if abs(c["top"] - prev["top"]) > y_tolerance:
+                out.append("\n")
+            elif c["x0"] - prev["x1"] > x_tolerance:
+                out.append(" ")
+        out.append(c["text"])
+        prev = c
+    return "".join(out)
+
+def iter_page_texts_pdfium(file_bytes):
+    """以 pypdfium2 (PDFium C++ 引擎) 逐頁取出文字，速度遠快於 pdfplumber"""
+    import pypdfium2 as pdfium # 有上傳 PDF 才載入，手動輸入時不必付出匯入成本
+    pdf = pdfium.PdfDocument(file_bytes)
+    try:
+        for page in pdf:
+            textpage = page.get_textpage()
             try:
-                roc_y = int(match.group(1))
-                m = int(match.group(2))
-                
-                # 簡單檢核：月份必須在 1-12 之間，年份不太可能小於 97 (國民年金開辦年)
-                if 1 <= m <= 12 and roc_y > 90:
-                    deadline = calculate_deadline_from_period(roc_y, m)
-                    extracted_period = f"{roc_y}年{m}月"
-                    match_source = source_name
-                    break # 找到了就跳出，不再嘗試後面的規則
-            except:
-                continue
+                yield textpage.get_text_range().replace("\r\n", "\n")
+            finally:
+                textpage.close()
+                page.close()
+    finally:
+        pdf.close()
+
+def iter_page_texts_pdfplumber(file_bytes):
+    """以 pdfplumber 逐頁取出文字 (備援：部分特殊編碼的 PDF，PDFium 讀不到文字)"""
+    import pdfplumber # 匯入 pdfminer.six 相當耗時，只在需要備援時才載入
+    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+        for page in pdf.pages:
+            yield page_text_from_chars(page)
+
+# 跨頁搜尋時保留的前文長度 (字元)，足以涵蓋一組關鍵字 + 年月或金額
+_PAGE_TAIL_CHARS = 64
+
+def scan_pages(page_texts):
+    """
+    逐頁讀取文字並嘗試抓取金額與保費年月，回傳 (各頁文字, 金額, 保費年月結果)
+    繳費單資料通常在第 1 頁：金額已找到、且保費年月來自最高優先規則時，就不再解析後面的頁面
+    保費年月跨頁保留優先順序最高的結果 (同優先則取較前面的)，與整份文字一次比對的結果相同
+    每頁只搜尋「前面文字的結尾 + 該頁文字」，不必每次重新串接、重掃前面的頁面；
+    保留前面文字的結尾是為了接住跨頁的關鍵字與數字 (例如上一頁結尾 "合計"、下一頁開頭 "4,000")
+    """
+    amount = 0
+    period = None
+    parts = []
+    prev_tail = ""
+    for page_text in page_texts:
+        if not page_text.strip():
+            continue
+        parts.append(page_text)
+        search_text = prev_tail + "\n" + page_text if prev_tail else page_text
+        prev_tail = search_text[-_PAGE_TAIL_CHARS:]
+        if not amount:
+            amount = find_amount(search_text)
+        if period is None or period[0] > 0:
+            found = find_period(search_text)
+            if found is not None and (period is None or found[0] < period[0]):
+                period = found
+        if amount and period is not None and period[0] == 0:
+            break
+    return parts, amount, period
+
+@st.cache_data(show_spinner=False, max_entries=32, ttl=3600)
+def parse_pdf(file_bytes):
+    """
+    解析繳費單 PDF，回傳 (原始文字, 金額, 繳費期限, 保費年月, 偵測依據)。
+    以檔案內容 (bytes) 作為快取鍵，Streamlit 重跑時同一份 PDF 不會重新解析。
+    快取為所有使用者共用且含個人帳單資料，限制筆數並於 1 小時後清除。
+    """
+    # 先用 PDFium 讀取，完全讀不到文字時才改用 pdfplumber
+    for iter_page_texts in (iter_page_texts_pdfium, iter_page_texts_pdfplumber):
+        parts, amount, period = scan_pages(iter_page_texts(file_bytes))
+        if parts:
+            break
+    text = "\n".join(parts)
+
+    # 預設值
+    deadline = date.today()
+    extracted_period = None 
+    match_source = "無" # 用於除錯，告訴你是哪個規則抓到的
+    if period is not None:
+        _, deadline, extracted_period, match_source = period
 
     # 回傳值多了一個 match_source 方便除錯
     return text, amount, deadline, extracted_period, match_source
 
+def year_start_dates(years):
+    """各年度的 1/1 (years 為西元年整數陣列，回傳 datetime64[D] 陣列)"""
+    return (years - 1970).astype("datetime64[Y]").astype("datetime64[D]")
+
+def year_end_dates(years):
+    """各年度的 12/31 (years 為西元年整數陣列，回傳 datetime64[D] 陣列)"""
+    return year_start_dates(years + 1) - np.timedelta64(1, "D")
+
+@njit(cache=True)
+def _interest_kernel(principal, start_day, end_day, year_end_days, rates_x1000, days, interests_x10):
+    """
+    利息計算核心 (純整數運算，安裝 numba 時會 JIT 編譯)
+    日期皆以整數日序號表示 (date.toordinal())
+    year_end_days / rates_x1000：區間內各年度年底的日序號與利率 (× 1000)
+    days / interests_x10：由呼叫端準備的輸出緩衝區，填入各年度天數與利息
+    回傳未捨入總利息，利息單位皆為「角」(0.1 元)
+    有 numba 時傳入 numpy 陣列；沒有時傳入 list，以純 Python 整數運算，省去 numpy 純量的額外成本
+    """
+    n = len(year_end_days)
+    total_interest_x10 = 0
+    seg_start_day = start_day
+    for i in range(n):
+        # 找出這一年在區間內的結束點 (年底或繳費前一日)
+        seg_end_day = min(year_end_days[i], end_day)
+        days_in_segment = seg_end_day - seg_start_day + 1
+
+        # 該段利息 = 本金 * 利率% * 天數 / 365
+        # 依規：小數點以下第2位無條件捨去 (即保留1位)
+        # 以角為單位：本金 * (利率×1000) * 天數 * 10 / (1000 * 100 * 365)，整數除法即為無條件捨去
+        interest_x10 = principal * rates_x1000[i] * days_in_segment // (365 * 10000)
+
+        days[i] = days_in_segment
+        interests_x10[i] = interest_x10
+        total_interest_x10 += interest_x10
+
+        # 推進到下一年
+        seg_start_day = year_end_days[i] + 1
+    return total_interest_x10
+
+@st.cache_data(show_spinner=False, max_entries=256)
 def calculate_interest(principal, deadline_date, payment_date):
     """
     核心計算邏輯
     公式：本金 × 利率 × (天數/365)
     規則：分段計算、小數點第二位無條件捨去、最後四捨五入
+    回傳 (最終利息, 未捨入總利息, 各年度明細)；明細為 (年度, 天數, 利率, 利息) 四個等長清單
+    以 (本金, 期限, 繳費日) 作為快取鍵，Streamlit 重跑時相同輸入直接取用結果 (限制筆數避免記憶體無限成長)。
     """
+    if not 0 <= principal <= MAX_PRINCIPAL:
+        raise ValueError(f"本金須介於 0 至 {MAX_PRINCIPAL} 元之間：{principal}")
+
     start_date = deadline_date + timedelta(days=1)
     end_date = payment_date - timedelta(days=1)
     
     if start_date > end_date:
-        return 0, []
+        return 0, 0.0, ([], [], [], [])
 
-    current = start_date
-    breakdown = []
-    total_interest_raw = 0.0
+    # 按年份分段計算：先備妥區間內各年度的年底日序號與利率，再交給核心函式
+    years = range(start_date.year, end_date.year + 1)
+    # 單筆計算只有少數幾個年度，直接用 date.toordinal() 比建立 numpy 暫存陣列便宜
+    year_end_days = [date(y, 12, 31).toordinal() for y in years]
+    rates_x1000 = [_RATES_X1000.get(y, _LATEST_RATE_X1000) for y in years]
+    start_day = start_date.toordinal()
+    end_day = end_date.toordinal()
+    if _HAVE_NUMBA:
+        # JIT 編譯後的核心需要 numpy 陣列
+        days = np.zeros(len(years), dtype=np.int64)
+        interests_x10 = np.zeros(len(years), dtype=np.int64)
+        total_interest_x10 = _interest_kernel(
+            int(principal), start_day, end_day,
+            np.array(year_end_days, dtype=np.int64), np.array(rates_x1000, dtype=np.int64),
+            days, interests_x10
+        )
+        days = days.tolist()
+        interests_x10 = interests_x10.tolist()
+    else:
+        days = [0] * len(years)
+        interests_x10 = [0] * len(years)
+        total_interest_x10 = _interest_kernel(
+            int(principal), start_day, end_day, year_end_days, rates_x1000, days, interests_x10
+        )
+
+    breakdown = (
+        list(years),
+        days,
+        [get_rate(y) for y in years],
+        [x10 / 10 for x10 in interests_x10],
+    )
 
-    # 逐日計算 (為了精確處理跨年度利率變動，雖然迴圈較多但邏輯最穩)
-    # 優化版：按年份分段計算
+    # 最後總利息四捨五入 (以角為單位，+5 後整除 10)
+    final_interest = (int(total_interest_x10) + 5) // 10
+    total_interest_raw = int(total_interest_x10) / 10
     
-    iter_date = start_date
-    while iter_date <= end_date:
-        year = iter_date.year
-        # 找出這一年在區間內的結束點 (年底或繳費前一日)
-        year_end = date(year, 12, 31)
-        segment_end = min(year_end, end_date)
-        
-        days_in_segment = (segment_end - iter_date).days + 1
-        rate = get_rate(year)
-        
-        # 該段利息 = 本金 * 利率% * 天數 / 365
-        # 依規：小數點以下第2位無條件捨去 (即保留1位)
-        interest_segment = (principal * rate * 0.01 * days_in_segment) / 365
-        interest_truncated = math.floor(interest_segment * 10) / 10.0
-        
-        breakdown.append({
-            "year": year,
-            "days": days_in_segment,
-            "rate": rate,
-            "interest": interest_truncated
-        })
-        
-        total_interest_raw += interest_truncated
-        
-        # 推進到下一段
-        iter_date = segment_end + timedelta(days=1)
+    return final_interest, total_interest_raw, breakdown
+
+def calculate_interest_batch(principals, deadlines, pay_dates):
+    """
+    批次版 calculate_interest：一次計算多筆繳費單的利息 (例如離線重算大量繳費單)
+    參數皆為等長陣列，日期可為 date 或 numpy.datetime64；回傳每筆的最終利息 (int 陣列)
+    以「筆數 × 年度」的矩陣一次算出所有分段，計算規則與 calculate_interest 相同
+    """
+    principals = np.asarray(principals, dtype=np.int64)
+    start = np.asarray(deadlines, dtype="datetime64[D]") + np.timedelta64(1, "D")
+    end = np.asarray(pay_dates, dtype="datetime64[D]") - np.timedelta64(1, "D")
+    if principals.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    if principals.min() < 0 or principals.max() > MAX_PRINCIPAL:
+        raise ValueError(f"本金須介於 0 至 {MAX_PRINCIPAL} 元之間")
+
+    # 涵蓋所有區間的年度，以及各年度的 1/1、12/31
+    first_year = int(start.min().astype("datetime64[Y]").astype(int)) + 1970
+    last_year = int(end.max().astype("datetime64[Y]").astype(int)) + 1970
+    years = np.arange(first_year, last_year + 1)
+    year_starts = year_start_dates(years)
+    year_ends = year_end_dates(years)
+    rates_x1000 = np.array([_RATES_X1000.get(int(y), _LATEST_RATE_X1000) for y in years], dtype=np.int64)
+
+    # 各筆在各年度的延遲天數 (不在區間內的年度為 0)
+    seg_start = np.maximum(start[:, None], year_starts[None, :])
+    seg_end = np.minimum(end[:, None], year_ends[None, :])
+    days = np.maximum((seg_end - seg_start).astype(np.int64) + 1, 0)
+
+    # 該段利息 = 本金 * 利率% * 天數 / 365，小數點以下第2位無條件捨去 (以角為單位的整數運算)
+    interests_x10 = principals[:, None] * rates_x1000[None, :] * days // (365 * 10000)
 
     # 最後總利息四捨五入
-    final_interest = int(round(total_interest_raw + 0.00001)) # +epsilon 處理 .5 進位問題
-    
-    return final_interest, breakdown
+    return (interests_x10.sum(axis=1) + 5) // 10
 
 # --- Streamlit 介面 ---
 
@@ -184,7 +393,7 @@ pdf_text_debug = ""
 if uploaded_file is not None:
     with st.spinner("正在分析 PDF..."):
         # 接收 5 個回傳值
-        pdf_text_debug, extracted_amount, extracted_deadline, extracted_period, match_source = parse_pdf(uploaded_file)
+        pdf_text_debug, extracted_amount, extracted_deadline, extracted_period, match_source = parse_pdf(uploaded_file.getvalue())
         
         # --- 除錯區塊 START ---
         with st.expander("🛠️ 開發者除錯模式 (點擊展開)", expanded=True):
@@ -198,7 +407,7 @@ if uploaded_file is not None:
             
             if not pdf_text_debug.strip():
                 st.error("⚠️ 警告：無法從 PDF 中提取任何文字！")
-                st.markdown("這張 PDF 可能是**「掃描圖片」**而非文字檔，`pdfplumber` 無法讀取圖片內的文字。請改用電子帳單 PDF，或是需要加入 OCR (文字辨識) 功能。")
+                st.markdown("這張 PDF 可能是**「掃描圖片」**而非文字檔，系統無法讀取圖片內的文字。請改用電子帳單 PDF，或是需要加入 OCR (文字辨識) 功能。")
             else:
                 st.text_area("PDF 原始讀取內容 (請檢查關鍵字是否存在)", pdf_text_debug, height=300)
         # --- 除錯區塊 END ---
@@ -206,7 +415,7 @@ if uploaded_file is not None:
         if extracted_amount > 0:
             default_amount = extracted_amount
             st.success("✅ 已成功讀取金額！")
-        if extracted_deadline != date.today():
+        if extracted_period: # 有抓到保費年月才會推算期限 (不與 date.today() 比較，避免快取跨日失準)
             default_deadline = extracted_deadline
             st.success(f"✅ 已成功讀取繳費期限：{default_deadline}")
 
@@ -214,7 +423,8 @@ if uploaded_file is not None:
 with st.container():
     col1, col2 = st.columns(2)
     with col1:
-        amount = st.number_input("繳費單本金 (元)", min_value=0, value=default_amount, step=100)
+        amount = st.number_input("繳費單本金 (元)", min_value=0, max_value=MAX_PRINCIPAL,
+                                 value=min(default_amount, MAX_PRINCIPAL), step=100)
     with col2:
         deadline = st.date_input("繳費期限", value=default_deadline)
     
@@ -225,7 +435,7 @@ if st.button("計算利息", type="primary"):
     if pay_date <= deadline:
         st.info("🎉 在期限內繳費，無需支付利息！")
     else:
-        interest, details = calculate_interest(amount, deadline, pay_date)
+        interest, total_raw, details = calculate_interest(amount, deadline, pay_date)
         
         # 顯示結果
         st.divider()
@@ -241,10 +451,10 @@ if st.button("計算利息", type="primary"):
             st.write(f"**計息區間**：{deadline + timedelta(days=1)} 至 {pay_date - timedelta(days=1)}")
             st.write("**計算公式**：本金 × 利率 × (天數/365)，分段計算後加總四捨五入。")
             
-            for row in details:
-                st.write(f"- **{row['year']}年度** (利率 {row['rate']}%)：延遲 {row['days']} 天 → 利息 {row['interest']} 元")
+            for year, days, rate, interest_segment in zip(*details):
+                st.write(f"- **{year}年度** (利率 {rate}%)：延遲 {days} 天 → 利息 {interest_segment} 元")
             
-            st.write(f"**總計 (未捨入)**：{sum(d['interest'] for d in details):.1f} 元")
+            st.write(f"**總計 (未捨入)**：{total_raw:.1f} 元")
 
 # 除錯區 (選用)
 # with st.expander("查看 PDF 原始文字 (除錯用)"):